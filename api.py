@@ -1,42 +1,123 @@
-from fastapi import FastAPI, UploadFile, Form
-import shutil
+from fastapi import FastAPI, UploadFile, Form, BackgroundTasks
+from fastapi.responses import FileResponse
+import aiofiles
+import asyncio
 import os
-from greenv7 import get_mp4_duration_mediainfo, combine_videos_for_duration, combine_green_screen_foreground_length
+import shutil
+import tempfile
+import threading
+from greenv7 import (BACKGROUND_CATEGORIES, get_mp4_duration_mediainfo, select_clips_for_duration,
+                     prepare_normalized_clips, combine_green_screen_single_pass)
 
 app = FastAPI()
 
-@app.post("/generate")
-async def generate_final_video(
-    foreground: UploadFile,
-    category: str = Form("Clips")
-):
-    # Save uploaded foreground
-    foreground_path = "foreground.mp4"
-    with open(foreground_path, "wb") as f:
-        shutil.copyfileobj(foreground.file, f)
+UPLOAD_CHUNK_SIZE = 1 << 20  # Stream uploads to disk 1 MiB at a time
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# See _X264_THREAD_ARGS in greenv7 for how each ffmpeg run is threaded. As
+# libx264 scales poorly past ~8 threads, the server runs one render or cache
+# conversion per 8 cores and queues the rest, while uploads and responses keep
+# being served on the event loop.
+MAX_CONCURRENT_RENDERS = max(1, (os.cpu_count() or 1) // 8)
+_render_slots = threading.BoundedSemaphore(MAX_CONCURRENT_RENDERS)
 
+
+def cache_normalized_clips(clip_paths: list[str]) -> None:
+    """
+    Converts clips that had no normalized copy, sharing the render slots so the
+    conversions never run alongside more renders than the CPU can take.
+    """
+    with _render_slots:
+        prepare_normalized_clips(clip_paths)
+
+
+def run_pipeline(foreground_path: str, clips_dir: str, final_output: str,
+                 background_tasks: BackgroundTasks) -> dict:
+    """
+    Runs the blocking video pipeline for one request. Called from a worker
+    thread so the event loop stays free while ffmpeg is running. Background
+    clips without a cached normalized copy are converted after the response
+    is sent, so later requests that pick them skip their normalization.
+    """
     # Check duration
     duration = get_mp4_duration_mediainfo(foreground_path)
     if duration is None:
         return {"error": "Could not determine duration of foreground video."}
 
-    clips_dir = category if os.path.exists(category) else "Clips"
-    background_output = "background_combined.mp4"
-    final_output = "final_output.mp4"
-
-    # Generate background
-    combine_videos_for_duration(
-        target_duration=duration,
-        output_filename=background_output,
-        clips_dir=clips_dir
-    )
-
-    # Apply green screen
-    combine_green_screen_foreground_length(
-        foreground_video=foreground_path,
-        background_video=background_output,
-        output_video=final_output
-    )
-
-    # Return result path
+    # Select background clips
+    selected_clips = select_clips_for_duration(duration, clips_dir=clips_dir)
+    # Only reuse cached normalized copies; uncached clips are normalized in the render graph
+    background_clips = prepare_normalized_clips(selected_clips, convert_missing=False)
+    if not background_clips:
+        return {"error": "No valid background clips were found."}
+
+    # Build background and apply green screen in one ffmpeg pass
+    with _render_slots:
+        combine_green_screen_single_pass(
+            foreground_video=foreground_path,
+            background_clips=background_clips,
+            output_video=final_output,
+            foreground_duration=duration
+        )
+
+    if not os.path.exists(final_output):
+        return {"error": "Video generation failed."}
+
+    uncached_clips = [clip for clip, prepared in zip(selected_clips, background_clips) if prepared == clip]
+    if uncached_clips:
+        background_tasks.add_task(cache_normalized_clips, uncached_clips)
+
     return {"message": "Video generated", "output": final_output}
+
+
+@app.post("/generate")
+async def generate_final_video(
+    foreground: UploadFile,
+    background_tasks: BackgroundTasks,
+    category: str = Form("Clips")
+):
+    # Each request gets its own working directory so concurrent requests
+    # never overwrite each other's foreground or output files
+    work_dir = tempfile.mkdtemp(prefix="greenscreen_")
+    foreground_path = os.path.join(work_dir, "foreground.mp4")
+    final_output = os.path.join(work_dir, "final_output.mp4")
+
+    # Removed once the response, including the rendered video, has been sent
+    background_tasks.add_task(shutil.rmtree, work_dir, ignore_errors=True)
+
+    pipeline = None
+    try:
+        # Save uploaded foreground
+        async with aiofiles.open(foreground_path, "wb") as f:
+            while chunk := await foreground.read(UPLOAD_CHUNK_SIZE):
+                await f.write(chunk)
+
+        # Only known background folders are used, since the clip caches are
+        # written into the selected directory
+        if category not in BACKGROUND_CATEGORIES or not os.path.isdir(os.path.join(APP_DIR, category)):
+            category = "Clips"
+        clips_dir = os.path.join(APP_DIR, category)
+
+        pipeline = asyncio.ensure_future(asyncio.to_thread(run_pipeline, foreground_path, clips_dir,
+                                                           final_output, background_tasks))
+        result = await asyncio.shield(pipeline)
+    except BaseException:
+        # No response will be sent. A worker thread cannot be interrupted, so if
+        # the client disconnected mid-render, ffmpeg may still be writing into
+        # the work directory; remove it only once the pipeline has finished.
+        if pipeline is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        else:
+            pipeline.add_done_callback(lambda _: shutil.rmtree(work_dir, ignore_errors=True))
+        raise
+
+    if "error" in result:
+        return result
+    return FileResponse(result["output"], media_type="video/mp4", filename="final_output.mp4")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # A single worker process, so MAX_CONCURRENT_RENDERS limits ffmpeg for the whole server
+    uvicorn.run("api:app", host="0.0.0.0", port=8000, workers=1)
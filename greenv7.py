@@ -1,17 +1,99 @@
 import os
+import json
+import math
+import asyncio
+import functools
+import hashlib
 import random
+import struct
 import subprocess
-import re # Import for regular expressions
+import tempfile
+import threading
+import time
 import sys # Import for sys.stdout.write and sys.stdout.flush
-from concurrent.futures import ThreadPoolExecutor
 from pymediainfo import MediaInfo
-import ffmpeg # This is for the ffmpeg-python library
 
 # =============================================================================
 # Section 1: MP4 Length Checker (Originally from MP4LengthChecker.py)
 # Utilizes pymediainfo to accurately determine the duration of a video file.
 # =============================================================================
 
+def _find_mp4_box(f, box_type: bytes, start: int, end: int) -> tuple[int, int] | None:
+    """
+    Scans the MP4 boxes between byte offsets `start` and `end` of an open file
+    for one of type `box_type`, seeking over the others without reading them.
+
+    Returns:
+        tuple[int, int]: The offsets where the box's payload starts and the box ends.
+        None: If no such box exists or the box headers are malformed.
+    """
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            return None
+        size, kind = struct.unpack(">I4s", header)
+        header_size = 8
+
+        if size == 1: # 64-bit box size follows the type
+            large_size = f.read(8)
+            if len(large_size) < 8:
+                return None
+            size = struct.unpack(">Q", large_size)[0]
+            header_size = 16
+        elif size == 0: # Box extends to the end of the file
+            size = end - offset
+
+        if size < header_size:
+            return None
+        if kind == box_type:
+            return offset + header_size, offset + size
+        offset += size
+    return None
+
+
+def _read_mp4_duration(filepath: str) -> float | None:
+    """
+    Reads an MP4's duration directly from its `moov/mvhd` box. Only a few box
+    headers are read, which is far cheaper than a full MediaInfo parse.
+
+    Returns:
+        float: The duration in seconds.
+        None: If the file cannot be read or has no usable `mvhd` box.
+    """
+    try:
+        with open(filepath, "rb") as f:
+            moov = _find_mp4_box(f, b"moov", 0, os.fstat(f.fileno()).st_size)
+            if moov is None:
+                return None
+            mvhd = _find_mp4_box(f, b"mvhd", *moov)
+            if mvhd is None:
+                return None
+
+            f.seek(mvhd[0])
+            version = f.read(1)
+            if version == b"\x01": # 64-bit times: timescale at offset 20, duration follows
+                f.seek(mvhd[0] + 20)
+                fields = f.read(12)
+                if len(fields) < 12:
+                    return None
+                timescale, duration = struct.unpack(">IQ", fields)
+            else: # 32-bit times: timescale at offset 12, duration follows
+                f.seek(mvhd[0] + 12)
+                fields = f.read(8)
+                if len(fields) < 8:
+                    return None
+                timescale, duration = struct.unpack(">II", fields)
+    except OSError:
+        return None
+
+    # Fragmented or still-recording files leave the duration as 0 or all ones
+    if timescale == 0 or duration == 0 or duration == (1 << (64 if version == b"\x01" else 32)) - 1:
+        return None
+    return duration / timescale
+
+
 def get_mp4_duration_mediainfo(filepath: str) -> float | None:
     """
     Checks the length (duration) of an MP4 file using pymediainfo.
@@ -19,6 +101,8 @@ def get_mp4_duration_mediainfo(filepath: str) -> float | None:
     This function is robust and uses the MediaInfo library (via pymediainfo)
     to parse media file metadata. It can handle various video formats,
     though it specifically warns if the file doesn't have an MP4 extension.
+    For MP4 files the duration is first read straight from the `mvhd` box,
+    and MediaInfo is only used if that fails.
 
     Args:
         filepath (str): The absolute or relative path to the MP4 file.
@@ -35,6 +119,10 @@ def get_mp4_duration_mediainfo(filepath: str) -> float | None:
     if not filepath.lower().endswith(('.mp4', '.m4v')):
         print(f"Warning: The file '{filepath}' does not appear to be an MP4 file, "
               "but MediaInfo will attempt to process it anyway.")
+    else:
+        duration = _read_mp4_duration(filepath)
+        if duration is not None:
+            return duration
 
     try:
         media_info = MediaInfo.parse(filepath)
@@ -54,60 +142,316 @@ def get_mp4_duration_mediainfo(filepath: str) -> float | None:
         return None
 
 
+# Clip durations are cached in memory, keyed by (path, mtime_ns, size), so an
+# edited or replaced clip is re-probed automatically. Each clip directory also
+# keeps a copy in `.durations.json` so the cache survives restarts. The lock
+# guards the cache because the API may select clips from several threads.
+# Alongside the durations, each directory keeps an exponentially weighted
+# moving average of the clip lengths probed in it, used to size probe batches.
+DURATION_CACHE_FILENAME = ".durations.json"
+DURATION_EWMA_ALPHA = 0.2
+_DUR_CACHE: dict[tuple[str, int, int], float] = {}
+_DUR_EWMA: dict[str, float] = {}
+_DUR_CACHE_LOCK = threading.Lock()
+_loaded_cache_dirs: set[str] = set()
+_dirty_cache_dirs: set[str] = set()
+
+
+def _load_duration_cache(clips_dir: str) -> None:
+    """
+    Loads `.durations.json` from a clip directory into the in-memory cache the
+    first time the directory is used. A missing or unreadable file is ignored.
+    The file is read while holding the lock, so a concurrent caller never sees
+    the directory as loaded before its durations are in the cache.
+    """
+    clips_dir = os.path.abspath(clips_dir)
+    with _DUR_CACHE_LOCK:
+        if clips_dir in _loaded_cache_dirs:
+            return
+        _loaded_cache_dirs.add(clips_dir)
+
+        try:
+            with open(os.path.join(clips_dir, DURATION_CACHE_FILENAME), "r") as f:
+                data = json.load(f)
+            entries = {
+                (os.path.join(clips_dir, name), int(mtime_ns), int(size)): float(duration)
+                for name, mtime_ns, size, duration in data["entries"]
+            }
+            ewma = float(data["ewma"]) if data.get("ewma") else None
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+
+        for key, duration in entries.items():
+            _DUR_CACHE.setdefault(key, duration)
+        if ewma is not None:
+            _DUR_EWMA.setdefault(clips_dir, ewma)
+
+
+def _is_current_cache_key(path: str, mtime_ns: int, size: int) -> bool:
+    """
+    Returns True if the file at `path` still has the given mtime and size.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+    return stat.st_mtime_ns == mtime_ns and stat.st_size == size
+
+
+def _save_duration_cache(clips_dir: str) -> None:
+    """
+    Writes the cached durations for a clip directory back to its `.durations.json`
+    if any were added. Entries for clips that were deleted or modified since
+    they were probed are pruned. The file is written to a temporary path first
+    and then renamed, so it is never left half-written.
+    """
+    clips_dir = os.path.abspath(clips_dir)
+    with _DUR_CACHE_LOCK:
+        if clips_dir not in _dirty_cache_dirs:
+            return
+        _dirty_cache_dirs.discard(clips_dir)
+        cached = [(key, duration) for key, duration in _DUR_CACHE.items()
+                  if os.path.dirname(key[0]) == clips_dir]
+        ewma = _DUR_EWMA.get(clips_dir)
+
+    # Stat outside the lock, since the directory may hold many clips
+    stale_keys = [key for key, _ in cached if not _is_current_cache_key(*key)]
+    if stale_keys:
+        with _DUR_CACHE_LOCK:
+            for key in stale_keys:
+                _DUR_CACHE.pop(key, None)
+    stale = set(stale_keys)
+    entries = [
+        [os.path.basename(path), mtime_ns, size, duration]
+        for (path, mtime_ns, size), duration in cached
+        if (path, mtime_ns, size) not in stale
+    ]
+
+    cache_path = os.path.join(clips_dir, DURATION_CACHE_FILENAME)
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=clips_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"entries": entries, "ewma": ewma}, f)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            os.remove(tmp_path)
+            raise
+    except OSError as e:
+        print(f"[!] Could not save duration cache to '{cache_path}': {e}")
+
+
+def _update_duration_ewma(clips_dir: str, duration: float) -> None:
+    """
+    Folds a newly probed clip duration into the directory's moving average.
+    Cached durations are not folded in again, so a warm lookup leaves the
+    average, and the cache file, untouched.
+    """
+    clips_dir = os.path.abspath(clips_dir)
+    with _DUR_CACHE_LOCK:
+        previous = _DUR_EWMA.get(clips_dir)
+        ewma = duration if previous is None else previous + DURATION_EWMA_ALPHA * (duration - previous)
+        if ewma != previous:
+            _DUR_EWMA[clips_dir] = ewma
+            _dirty_cache_dirs.add(clips_dir)
+
+
+def _probe_duration_cached(path: str, stat: os.stat_result | None = None) -> float | None:
+    """
+    Returns the duration of a clip in seconds, using the duration cache when the
+    file is unchanged. On a cache miss the `mvhd` box is read directly, falling
+    back to MediaInfo for files that are not plain MP4s. Pass `stat` if the
+    file's stat result is already known to skip another stat call.
+    """
+    path = os.path.abspath(path)
+    if stat is None:
+        stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+
+    with _DUR_CACHE_LOCK:
+        if key in _DUR_CACHE:
+            return _DUR_CACHE[key]
+
+    duration = _read_mp4_duration(path)
+    if duration is None:
+        media_info = MediaInfo.parse(path)
+        for track in media_info.tracks:
+            if track.track_type in ('General', 'Video') and track.duration is not None:
+                duration = float(track.duration / 1000)
+                break
+        else:
+            return None
+
+    with _DUR_CACHE_LOCK:
+        _DUR_CACHE[key] = duration
+        _dirty_cache_dirs.add(os.path.dirname(path))
+    _update_duration_ewma(os.path.dirname(path), duration)
+    return duration
+
+
+# Video encoders in order of preference: hardware encoders first, then the
+# fastest software encoders. libx264 is always the final fallback.
+_ENCODER_PREFERENCE = ["h264_nvenc", "h264_videotoolbox", "h264_qsv", "libsvtav1", "libx264"]
+
+# Keep FFmpeg's log output to errors only. Nothing reads its informational
+# output, so there is no point producing and buffering it.
+_FFMPEG_QUIET_ARGS = ["-hide_banner", "-loglevel", "error", "-nostats"]
+
+# A single FFmpeg process already spreads libx264 work across every core, so
+# this module runs its encodes one at a time and lets x264 pick its own thread
+# counts. Callers that render concurrently (the API) must limit it themselves.
+_X264_THREAD_ARGS = [
+    "-threads", "0",
+    "-x264-params", "threads=0:lookahead-threads=2:sliced-threads=0",
+]
+
+
+# Extra libx264 options for intermediate files that will be re-encoded later:
+# no B-frames, a single reference frame and no lookahead trade a little file
+# size for a much faster encode.
+_X264_INTERMEDIATE_ARGS = ["-tune", "fastdecode", "-bf", "0", "-refs", "1", "-rc-lookahead", "0"]
+
+QUALITY_TIERS = ("intermediate", "final")
+
+
+def _encoder_works(encoder: str) -> bool:
+    """
+    Runs a tiny test encode to check that an encoder is actually usable.
+    FFmpeg builds often list hardware encoders even when no device is present.
+    """
+    command = [
+        "ffmpeg", *_FFMPEG_QUIET_ARGS,
+        "-f", "lavfi", "-i", "color=size=256x256:duration=0.1",
+        "-frames:v", "1", "-c:v", encoder,
+        "-f", "null", "-"
+    ]
+    try:
+        return subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
+    except OSError:
+        return False
+
+
+@functools.lru_cache(maxsize=None)
+def _detect_encoder() -> str:
+    """
+    Returns the first usable encoder from `_ENCODER_PREFERENCE`.
+    The result is cached, so FFmpeg is only queried once per process.
+    """
+    try:
+        result = subprocess.run(["ffmpeg", "-hide_banner", "-encoders"],
+                                capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return "libx264"
+
+    available = {fields[1] for fields in map(str.split, result.stdout.splitlines()) if len(fields) > 1}
+    for encoder in _ENCODER_PREFERENCE[:-1]:
+        if encoder in available and _encoder_works(encoder):
+            return encoder
+    return "libx264"
+
+
+def _video_encoder_args(video_codec: str, preset_val: str = "veryfast",
+                        crf_val: int | None = None, quality_tier: str = "final") -> list[str]:
+    """
+    Builds the `-c:v` arguments for an encoder, mapping the libx264-style preset
+    and CRF onto each encoder's own speed and quality options. When `crf_val` is
+    None, no quality option is added and rate control is left to the caller.
+    The "intermediate" quality tier adds libx264 options for fast throwaway encodes.
+    """
+    if quality_tier not in QUALITY_TIERS:
+        raise ValueError(f"quality_tier must be one of {QUALITY_TIERS}, got '{quality_tier}'")
+
+    if video_codec == "h264_nvenc":
+        speed_args = ["-preset", "p4", "-tune", "hq"]
+        quality_args = ["-rc", "vbr", "-cq", str(crf_val)]
+    elif video_codec == "h264_videotoolbox":
+        speed_args = ["-allow_sw", "1"]
+        # VideoToolbox quality runs 1-100, higher is better; CRF 23 maps to 54
+        quality_args = ["-q:v", str(max(1, min(100, 100 - 2 * crf_val)))] if crf_val is not None else []
+    elif video_codec == "h264_qsv":
+        speed_args = ["-preset", preset_val]
+        quality_args = ["-global_quality", str(crf_val)]
+    elif video_codec == "libsvtav1":
+        # The libx264 preset names have no SVT-AV1 equivalent, so the fastest
+        # preset is always used. AV1 CRF runs 0-63 and CRF 30 looks roughly
+        # like x264's CRF 23, so the CRF is shifted by 7.
+        speed_args = ["-preset", "12"]
+        quality_args = ["-crf", str(min(63, crf_val + 7))] if crf_val is not None else []
+    elif video_codec == "libx264":
+        speed_args = [*_X264_THREAD_ARGS, "-preset", preset_val]
+        if quality_tier == "intermediate":
+            speed_args += _X264_INTERMEDIATE_ARGS
+        quality_args = ["-crf", str(crf_val)]
+    else:
+        speed_args = []
+        quality_args = []
+
+    return ["-c:v", video_codec, *speed_args, *(quality_args if crf_val is not None else [])]
+
+
 # =============================================================================
 # Section 2: Satisfying Video Generator (Originally from satisfyingGeneratorcode2.py)
 # Handles converting and combining multiple short video clips into a single
 # background video, ensuring it meets a target duration.
 # =============================================================================
 
-def generate_variables(num_vars: int) -> dict[str, int]:
-    """
-    Generates a dictionary of unique random numbers (1-99) for a given count.
-    Used for selecting 'Clip (X).mp4' files.
-    """
-    if not isinstance(num_vars, int) or num_vars < 1:
-        raise ValueError("num_vars must be a positive integer")
-    if num_vars > 99:
-        raise ValueError("num_vars cannot be greater than 99, to ensure unique numbers between 1 and 99")
-
-    generated_numbers = set()
-    variables = {}
-    for i in range(1, num_vars + 1):
-        variable_name = f"var_{i}"
-        while True:
-            random_number = random.randint(1, 99)
-            if random_number not in generated_numbers:
-                generated_numbers.add(random_number)
-                variables[variable_name] = random_number
-                break
-    return variables
+# Frame rate every clip is normalized to. Cached normalized copies are keyed by
+# it, so the CLI and the API must render at the same rate to share the cache.
+TARGET_FRAME_RATE = 29.97
+
+
+def _normalize_video_filter(frame_width: int = 1080, frame_height: int = 1920,
+                            frame_rate: float = TARGET_FRAME_RATE) -> str:
+    """
+    Returns the filter chain that scales a clip to fit the target resolution
+    (letterboxed to keep its aspect ratio), resamples it to `frame_rate` and
+    resets its sample aspect ratio.
+    """
+    return (f"scale={frame_width}:{frame_height}:force_original_aspect_ratio=decrease,"
+            f"pad={frame_width}:{frame_height}:(ow-iw)/2:(oh-ih)/2,"
+            f"fps={frame_rate},setsar=1")
+
+
+def _convert_output_args(video_codec: str, frame_width: int = 1080, frame_height: int = 1920,
+                         frame_rate: float = TARGET_FRAME_RATE, bitrate: str = "6M",
+                         preset_val: str = "veryfast", quality_tier: str = "final") -> list[str]:
+    """
+    Returns the encoder and filter arguments `convert_video_format` applies to
+    its output, so cached copies can be keyed by exactly what produced them.
+    """
+    return [
+        *_video_encoder_args(video_codec, preset_val, quality_tier=quality_tier),
+        "-an",
+        "-vf", _normalize_video_filter(frame_width, frame_height, frame_rate),
+        "-b:v", bitrate,
+        "-pix_fmt", "yuv420p",
+    ]
 
 
 def convert_video_format(input_file: str, output_file: str,
-                         target_format: str = "mp4", video_codec: str = "libx264",
+                         target_format: str = "mp4", video_codec: str | None = None,
                          audio_codec: str = "aac", frame_width: int = 1080,
-                         frame_height: int = 1920, frame_rate: float = 29.97,
-                         bitrate: str = "6M", preset_val: str = "veryfast") -> str | None:
+                         frame_height: int = 1920, frame_rate: float = TARGET_FRAME_RATE,
+                         bitrate: str = "6M", preset_val: str = "veryfast",
+                         quality_tier: str = "final") -> str | None:
     """
     Converts a single video file to a specified format and resolution using FFmpeg.
+    If `video_codec` is None, the fastest available encoder is used.
+    Audio is dropped, since background clips only ever contribute video;
+    `audio_codec` is deprecated and ignored, and only kept for existing callers.
     """
     command = [
-        "ffmpeg", "-y",
+        "ffmpeg", *_FFMPEG_QUIET_ARGS, "-y",
         "-i", input_file,
-        "-c:v", video_codec,
-        "-c:a", audio_codec,
-        "-vf", f"scale={frame_width}:{frame_height}",
-        "-r", str(frame_rate),
-        "-b:v", bitrate,
-        "-pix_fmt", "yuv420p",
-        "-preset", preset_val,
+        *_convert_output_args(video_codec or _detect_encoder(), frame_width, frame_height,
+                              frame_rate, bitrate, preset_val, quality_tier),
         output_file
     ]
 
     try:
-        # Note: For individual clip conversions in parallel, a detailed progress bar
-        # per clip would be complex to display. We'll just show completion here.
-        subprocess.run(command, check=True, capture_output=True, text=True)
+        # Note: A detailed progress bar per clip would be noisy for short clips,
+        # so we just show completion here.
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
         print(f"[✓] Converted {os.path.basename(input_file)} -> {os.path.basename(output_file)}")
         return output_file
     except subprocess.CalledProcessError as e:
@@ -115,35 +459,144 @@ def convert_video_format(input_file: str, output_file: str,
         return None
 
 
-def convert_video_format_parallel(input_files: list[str], target_format: str = "mp4",
-                                  frame_width: int = 1080, frame_height: int = 1920,
-                                  frame_rate: float = 30, bitrate: str = "6M",
-                                  max_workers: int = 4, preset_val: str = "veryfast") -> list[str]:
+# Normalized copies of background clips are kept in `<clips_dir>/.normalized`
+# and reused by later runs. The least recently used files are evicted once the
+# directory grows past NORMALIZED_CACHE_MAX_BYTES.
+NORMALIZED_DIRNAME = ".normalized"
+NORMALIZED_CACHE_MAX_BYTES = 10 * 1024 ** 3
+
+
+def _evict_normalized_clips(cache_dir: str, max_bytes: int = NORMALIZED_CACHE_MAX_BYTES) -> None:
+    """
+    Deletes the least recently used normalized clips until the cache directory
+    is no larger than `max_bytes`. Conversions still in progress are left alone.
+    """
+    cached_files = []
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            if entry.is_file() and entry.name.endswith(".mp4") and not entry.name.startswith(".tmp-"):
+                stat = entry.stat()
+                cached_files.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total_size = sum(size for _, size, _ in cached_files)
+    for _, size, path in sorted(cached_files):
+        if total_size <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total_size -= size
+        except OSError:
+            pass
+
+
+def _is_normalized_clip(clip_path: str) -> bool:
+    """
+    Returns True if `clip_path` points into a normalized clip cache directory.
     """
-    Converts multiple video files in parallel using `convert_video_format`.
+    return os.path.basename(os.path.dirname(os.path.abspath(clip_path))) == NORMALIZED_DIRNAME
+
+
+def get_normalized_clip(clip_path: str, frame_width: int = 1080, frame_height: int = 1920,
+                        frame_rate: float = TARGET_FRAME_RATE, video_codec: str | None = None,
+                        convert_missing: bool = True) -> str | None:
     """
-    futures = []
-    converted_files = []
+    Returns the path of a copy of `clip_path` converted to the target resolution,
+    frame rate and codec, converting it only if no cached copy exists yet.
+    The cache entry is keyed by the source path, its mtime and the full set of
+    encoder and filter arguments, so an edited clip or a change of settings
+    produces a new copy.
+    If `video_codec` is None, the fastest available encoder is used.
+
+    Returns:
+        str: The path of the normalized copy.
+        None: If the conversion failed, or no copy is cached and `convert_missing` is False.
+    """
+    clip_path = os.path.abspath(clip_path)
+    video_codec = video_codec or _detect_encoder()
+    cache_dir = os.path.join(os.path.dirname(clip_path), NORMALIZED_DIRNAME)
+
+    output_args = _convert_output_args(video_codec, frame_width, frame_height, frame_rate)
+    signature = hashlib.sha1(
+        f"{clip_path}:{os.stat(clip_path).st_mtime_ns}:{' '.join(output_args)}".encode()
+    ).hexdigest()
+    normalized_path = os.path.join(cache_dir, f"{signature}.mp4")
+
+    if os.path.exists(normalized_path):
+        os.utime(normalized_path) # Mark as recently used for eviction
+        return normalized_path
+    if not convert_missing:
+        return None
+
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=".tmp-", suffix=".mp4")
+    os.close(fd)
+
+    try:
+        # Normalized copies can be stream-copied straight into the output, so
+        # they are encoded with the final quality settings
+        if convert_video_format(clip_path, tmp_path, video_codec=video_codec, frame_width=frame_width,
+                                frame_height=frame_height, frame_rate=frame_rate) is None:
+            return None
+        os.replace(tmp_path, normalized_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    _evict_normalized_clips(cache_dir)
+    return normalized_path
 
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        for i, input_file in enumerate(input_files):
-            output_file = f"temp_clip_{i}.{target_format}"
-            future = executor.submit(
-                convert_video_format,
-                input_file, output_file, target_format,
-                "libx264", "aac", frame_width, frame_height,
-                frame_rate, bitrate, preset_val
-            )
-            futures.append((future, output_file))
 
-        for future, output_file in futures:
-            result = future.result()
-            if result:
-                converted_files.append(result)
-            else:
-                print(f"[!] Skipping {os.path.basename(output_file)} due to error.")
+def prepare_normalized_clips(clip_paths: list[str], frame_width: int = 1080, frame_height: int = 1920,
+                             frame_rate: float = TARGET_FRAME_RATE, video_codec: str | None = None,
+                             convert_missing: bool = True) -> list[str]:
+    """
+    Maps each clip to its cached normalized copy. Missing copies are converted
+    one at a time if `convert_missing` is True. A clip keeps its original path
+    when it has no cached copy or cannot be normalized, e.g. because the clip
+    library is read-only or FFmpeg is unavailable.
+    """
+    prepared_clips = []
+    for clip_path in clip_paths:
+        try:
+            normalized_path = get_normalized_clip(clip_path, frame_width, frame_height, frame_rate,
+                                                  video_codec, convert_missing)
+        except OSError as e:
+            print(f"[!] Could not normalize {os.path.basename(clip_path)}, using the original: {e}")
+            normalized_path = None
 
-    return converted_files
+        prepared_clips.append(normalized_path or clip_path)
+    return prepared_clips
+
+
+# Cache misses are probed concurrently; MediaInfo runs in worker threads, and
+# this caps how many files are being parsed at once.
+PROBE_CONCURRENCY = 16
+
+
+async def _probe_durations_concurrently(clip_entries: list[os.DirEntry]) -> list[float | None]:
+    """
+    Probes the durations of several clips at once, returning them in the same
+    order as `clip_entries`. Clips that cannot be read are reported and yield None.
+    """
+    semaphore = asyncio.Semaphore(PROBE_CONCURRENCY)
+
+    async def probe(entry: os.DirEntry) -> float | None:
+        async with semaphore:
+            try:
+                duration = await asyncio.to_thread(_probe_duration_cached, entry.path, entry.stat())
+            except Exception as e:
+                print(f"[!] Failed to read duration for {entry.name} (using MediaInfo): {e}")
+                return None
+        if duration is None:
+            print(f"[!] No duration information found for {entry.name}")
+        return duration
+
+    return await asyncio.gather(*(probe(entry) for entry in clip_entries))
+
+
+# Probe batches are sized from the average clip length, with this much slack
+# so the first batch almost always covers the target duration.
+PROBE_BATCH_OVERSAMPLE = 1.3
 
 
 def select_clips_for_duration(target_duration: float, clips_dir: str = "Clips",
@@ -151,132 +604,297 @@ def select_clips_for_duration(target_duration: float, clips_dir: str = "Clips",
     """
     Selects random video clips from a directory until their combined duration
     meets or exceeds the specified target duration.
+
+    Clips are probed in concurrent batches. Each batch is sized from the
+    directory's average clip length to cover the remaining duration, so usually
+    only one batch is needed. Without an average yet, one batch of
+    PROBE_CONCURRENCY clips is probed first.
     """
     selected_clips = []
     total_duration = 0.0
 
-    clip_files = [f for f in os.listdir(clips_dir) if f.lower().endswith(".mp4")]
-    random.shuffle(clip_files)
+    _load_duration_cache(clips_dir)
+    with os.scandir(clips_dir) as it:
+        remaining_entries = [entry for entry in it if entry.is_file() and entry.name.lower().endswith(".mp4")]
+    random.shuffle(remaining_entries)
 
-    for clip_file in clip_files:
-        clip_path = os.path.join(clips_dir, clip_file)
-        try:
-            probe = ffmpeg.probe(clip_path)
-            duration = float(probe['format']['duration'])
+    ewma = _DUR_EWMA.get(os.path.abspath(clips_dir))
+    while remaining_entries and total_duration < target_duration:
+        if ewma:
+            batch_size = math.ceil((target_duration - total_duration) / ewma * PROBE_BATCH_OVERSAMPLE)
+        else:
+            batch_size = PROBE_CONCURRENCY
+        batch, remaining_entries = remaining_entries[:batch_size], remaining_entries[batch_size:]
+
+        durations = asyncio.run(_probe_durations_concurrently(batch))
+        ewma = _DUR_EWMA.get(os.path.abspath(clips_dir))
 
-            if duration >= min_clip_length:
-                selected_clips.append(clip_path)
+        for entry, duration in zip(batch, durations):
+            if duration is not None and duration >= min_clip_length:
+                selected_clips.append(entry.path)
                 total_duration += duration
                 if total_duration >= target_duration:
                     break
-        except Exception as e:
-            print(f"[!] Failed to read duration for {os.path.basename(clip_file)} (using FFprobe): {e}")
+
+    _save_duration_cache(clips_dir)
 
     if total_duration < target_duration:
         print(f"⚠️ Warning: Not enough clips ({total_duration:.2f}s) to meet the target duration ({target_duration:.2f}s).")
     return selected_clips
 
 
-def _parse_ffmpeg_progress(process, total_duration, frame_rate, description="Processing"):
+# Keys of interest in FFmpeg's `-progress` output. Lines are matched as bytes,
+# so only the values that get printed are ever decoded.
+_PROGRESS_FRAME = b"frame"
+_PROGRESS_OUT_TIME_US = b"out_time_us"
+_PROGRESS_SPEED = b"speed"
+_PROGRESS_TICK = b"progress"
+_PROGRESS_END = b"end"
+_PROGRESS_ENCODING = sys.getdefaultencoding()
+
+# Minimum time in seconds between progress bar redraws.
+PROGRESS_REFRESH_INTERVAL = 0.1
+
+
+async def _parse_ffmpeg_progress(process, total_duration, frame_rate, description="Processing"):
     """
-    Parses FFmpeg's stderr output to display a real-time progress bar.
+    Reads FFmpeg's `-progress pipe:1` output to display a real-time progress bar.
+    FFmpeg writes one `key=value` pair per line and ends each update with a
+    `progress=continue` (or `progress=end`) line, which is when the bar is redrawn,
+    at most every PROGRESS_REFRESH_INTERVAL seconds. The final update is always shown.
+    Progress is measured from `out_time_us`, so it stays accurate even when the
+    output frame rate differs from `frame_rate`.
 
     Args:
-        process (subprocess.Popen): The FFmpeg subprocess object.
+        process (asyncio.subprocess.Process): The FFmpeg subprocess object.
         total_duration (float): The total duration of the video being processed in seconds.
         frame_rate (float): The frame rate of the video.
         description (str): A string to describe the current operation in the progress bar.
     """
-    frame_re = re.compile(r"frame=\s*(\d+)") # Regex to capture frame number
-
-    prev_progress_line_length = 0
     total_frames = int(total_duration * frame_rate) if frame_rate > 0 else 0
 
-    for line in process.stderr:
-        line = line.decode(sys.getdefaultencoding(), errors='ignore').strip()
+    current_frame = 0
+    progress_percent = 0.0
+    speed = "N/A"
+    last_redraw = 0.0
+
+    async for line in process.stdout:
+        key, _, value = line.strip().partition(b"=")
+
+        if key == _PROGRESS_FRAME and value.isdigit():
+            current_frame = int(value)
+        elif key == _PROGRESS_OUT_TIME_US and value.isdigit():
+            out_time = int(value) / 1_000_000
+            progress_percent = min(out_time / total_duration * 100, 100.0) if total_duration > 0 else 0
+        elif key == _PROGRESS_SPEED:
+            speed = value.strip().decode(_PROGRESS_ENCODING, errors='ignore')
+        elif key == _PROGRESS_TICK:
+            now = time.monotonic()
+            if now - last_redraw < PROGRESS_REFRESH_INTERVAL and value.strip() != _PROGRESS_END:
+                continue
+            last_redraw = now
+
+            # Fixed-width fields keep every redraw the same length, so no padding is needed
+            sys.stdout.write(f"\r{description}: {current_frame:>7d}/{total_frames:>7d} frames "
+                             f"({progress_percent:6.2f}%, {speed:>8})")
+            sys.stdout.flush()
 
-        frame_match = frame_re.search(line)
+    sys.stdout.write("\n")
+    sys.stdout.flush()
 
-        if frame_match:
-            current_frame = int(frame_match.group(1))
 
-            progress_percent = (current_frame / total_frames) * 100 if total_frames > 0 else 0
+# Buffer limit for FFmpeg's pipes. A larger buffer absorbs bursts of output
+# without pausing the pipe.
+FFMPEG_PIPE_BUFFER_SIZE = 1 << 20
 
-            progress_line = f"\r{description}: {current_frame}/{total_frames} frames ({progress_percent:.2f}%)"
-            sys.stdout.write(progress_line.ljust(prev_progress_line_length))
-            sys.stdout.flush()
-            prev_progress_line_length = len(progress_line)
 
-    sys.stdout.write("\n")
-    sys.stdout.flush()
+async def _write_stdin(process, data: bytes) -> None:
+    """
+    Writes `data` to a subprocess's stdin and closes it. If the process exits
+    before reading everything, the broken pipe is ignored; its exit code
+    reports the failure.
+    """
+    try:
+        process.stdin.write(data)
+        await process.stdin.drain()
+        process.stdin.close()
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+
+
+async def _run_ffmpeg_async(command: list[str], total_duration: float, frame_rate: float,
+                            description: str, stdin_data: bytes | None = None) -> tuple[int, bytes]:
+    """
+    Runs an FFmpeg command that reports progress on stdout, showing a progress
+    bar while draining stderr concurrently so neither pipe can fill up and stall.
+    If `stdin_data` is given, it is fed to FFmpeg's stdin (e.g. for `-i pipe:0`).
+    Returns the exit code and the captured stderr.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        stdin=asyncio.subprocess.PIPE if stdin_data is not None else asyncio.subprocess.DEVNULL,
+        limit=FFMPEG_PIPE_BUFFER_SIZE
+    )
+    tasks = [
+        _parse_ffmpeg_progress(process, total_duration, frame_rate, description),
+        process.stderr.read()
+    ]
+    if stdin_data is not None:
+        tasks.append(_write_stdin(process, stdin_data))
+
+    _, stderr, *_ = await asyncio.gather(*tasks)
+    await process.wait()
+    return process.returncode, stderr
+
+
+def _run_ffmpeg(command: list[str], total_duration: float, frame_rate: float,
+                description: str = "Processing", stdin_data: bytes | None = None) -> tuple[int, bytes]:
+    """
+    Blocking wrapper around `_run_ffmpeg_async` for the synchronous pipeline functions.
+    """
+    return asyncio.run(_run_ffmpeg_async(command, total_duration, frame_rate, description, stdin_data))
+
+
+def _build_concat_list(clip_paths: list[str]) -> bytes:
+    """
+    Builds a script for FFmpeg's concat demuxer listing `clip_paths` in order.
+    It is passed to FFmpeg on stdin, so no list file is written to disk.
+    """
+    lines = []
+    for clip_path in clip_paths:
+        escaped_path = os.path.abspath(clip_path).replace("'", "'\\''")
+        lines.append(f"file '{escaped_path}'\n")
+    return "".join(lines).encode()
+
+
+def _build_background_filtergraph(num_inputs: int, first_input_index: int = 0,
+                                  frame_width: int = 1080, frame_height: int = 1920,
+                                  frame_rate: float = TARGET_FRAME_RATE,
+                                  output_label: str = "bg") -> str:
+    """
+    Builds a filtergraph fragment that normalizes each background input to the
+    same resolution (letterboxed to keep its aspect ratio), frame rate and SAR,
+    then joins them with FFmpeg's concat filter into a stream labelled `output_label`.
+    """
+    normalize_filter = _normalize_video_filter(frame_width, frame_height, frame_rate)
+    normalize = "".join(
+        f"[{first_input_index + i}:v]{normalize_filter}[v{i}];"
+        for i in range(num_inputs)
+    )
+    concat_inputs = "".join(f"[v{i}]" for i in range(num_inputs))
+    return f"{normalize}{concat_inputs}concat=n={num_inputs}:v=1:a=0[{output_label}]"
+
+
+# Clips without a normalized copy each need their own FFmpeg input and decoder,
+# and every input lengthens the command line. Past this many, the extra clips
+# are left out of the render; they are cached once it finishes, so this only
+# happens while a library's cache is still cold.
+MAX_RAW_BACKGROUND_INPUTS = 30
+
+
+def _build_background_inputs(background_clips: list[str], first_input_index: int = 0,
+                             frame_width: int = 1080, frame_height: int = 1920,
+                             frame_rate: float = TARGET_FRAME_RATE,
+                             output_label: str = "bg") -> tuple[list[str], bytes | None, str]:
+    """
+    Builds the FFmpeg input arguments and filtergraph fragment for a background
+    made of `background_clips`. Normalized copies all share one format, so they
+    are read through a single concat-demuxer input whose list is fed on stdin.
+    Other clips get one input each, at most MAX_RAW_BACKGROUND_INPUTS of them;
+    any beyond that are skipped rather than transcoded on the render path.
+
+    Returns:
+        tuple: The input arguments, the stdin data for the concat demuxer (None
+               if unused), and a filtergraph fragment producing `output_label`.
+    """
+    normalized_clips = [clip for clip in background_clips if _is_normalized_clip(clip)]
+    raw_clips = [clip for clip in background_clips if not _is_normalized_clip(clip)]
+
+    if len(raw_clips) > MAX_RAW_BACKGROUND_INPUTS:
+        print(f"[!] Skipping {len(raw_clips) - MAX_RAW_BACKGROUND_INPUTS} background clip(s): "
+              f"too many unnormalized clips for one render.")
+        raw_clips = raw_clips[:MAX_RAW_BACKGROUND_INPUTS]
+
+    input_args = []
+    stdin_data = None
+    if normalized_clips:
+        input_args += ["-f", "concat", "-safe", "0", "-protocol_whitelist", "pipe,file", "-i", "pipe:0"]
+        stdin_data = _build_concat_list(normalized_clips)
+    for clip in raw_clips:
+        input_args += ["-i", clip]
+
+    num_inputs = (1 if normalized_clips else 0) + len(raw_clips)
+    filter_graph = _build_background_filtergraph(num_inputs, first_input_index, frame_width,
+                                                 frame_height, frame_rate, output_label)
+    return input_args, stdin_data, filter_graph
 
 
 def combine_videos_for_duration(target_duration: float, output_filename: str = "combinedVideos.mp4",
                                 clips_dir: str = "Clips", frame_width: int = 1080,
-                                frame_height: int = 1920, frame_rate: float = 29.97,
-                                bitrate: str = "6M", preset_val: str = "veryfast", crf_val: int = 23) -> None:
+                                frame_height: int = 1920, frame_rate: float = TARGET_FRAME_RATE,
+                                bitrate: str = "6M", preset_val: str = "veryfast", crf_val: int = 23,
+                                video_codec: str | None = None, quality_tier: str = "final") -> None:
     """
-    Selects clips to match a target duration, converts them, and then combines them
-    into a single output video using FFmpeg's concat demuxer, with a progress bar.
+    Selects clips to match a target duration and combines them into a single
+    output video with one FFmpeg run. The selected clips are swapped for their
+    cached normalized copies, which share one codec, resolution and frame rate,
+    so they are joined with FFmpeg's concat demuxer and stream-copied without
+    re-encoding. The clip list is fed to FFmpeg on stdin, and the input is cut
+    at `target_duration`, so the unused tail of the last clip is not copied.
+    If some clips cannot be normalized (e.g. a read-only clip library), the
+    background is re-encoded instead, using `bitrate`, `preset_val` and `crf_val`.
+    If `video_codec` is None, the fastest available encoder is used. Use
+    `quality_tier="intermediate"` when the result will be re-encoded later, e.g.
+    as the background for `combine_green_screen_foreground_length`.
     """
     input_files = select_clips_for_duration(target_duration, clips_dir=clips_dir)
+    input_files = prepare_normalized_clips(input_files, frame_width, frame_height, frame_rate, video_codec)
 
     if not input_files:
         print("Error: No valid input files were selected for background generation.")
         return
 
-    print("🔄 Converting selected background video clips in parallel...")
-    converted_files = convert_video_format_parallel(
-        input_files,
-        target_format="mp4",
-        frame_width=frame_width,
-        frame_height=frame_height,
-        frame_rate=frame_rate,
-        bitrate=bitrate,
-        max_workers=min(8, len(input_files)),
-        preset_val=preset_val
-    )
-
-    if not converted_files:
-        print("❌ No background videos were successfully converted.")
-        return
-
-    input_list_filename = "temp_background_input_files.txt"
     output_path = os.path.abspath(output_filename)
 
-    try:
-        with open(input_list_filename, "w") as f:
-            for converted_file in converted_files:
-                f.write(f"file '{converted_file}'\n")
-    except Exception as e:
-        print(f"❌ Could not create input list file for background combination: {e}")
-        return
+    if all(_is_normalized_clip(f) for f in input_files):
+        stdin_data = _build_concat_list(input_files)
+        command = [
+            "ffmpeg", *_FFMPEG_QUIET_ARGS, "-y",
+            "-progress", "pipe:1",
+            "-f", "concat", "-safe", "0",
+            "-protocol_whitelist", "pipe,file",
+            "-t", str(target_duration), # Stop reading once the target is covered
+            "-i", "pipe:0",
+            "-map", "0:v",
+            "-c", "copy",
+            "-avoid_negative_ts", "make_zero",
+            output_path
+        ]
+    else:
+        input_args, stdin_data, filter_graph = _build_background_inputs(
+            input_files, frame_width=frame_width, frame_height=frame_height,
+            frame_rate=frame_rate
+        )
+        command = [
+            "ffmpeg", *_FFMPEG_QUIET_ARGS, "-y",
+            "-progress", "pipe:1",
+            *input_args,
+            "-filter_complex", filter_graph,
+            "-map", "[bg]",
+            *_video_encoder_args(video_codec or _detect_encoder(), preset_val, crf_val, quality_tier),
+            "-pix_fmt", "yuv420p",
+            "-b:v", bitrate,
+            "-t", str(target_duration),
+            output_path
+        ]
 
-    print(f"🎬 Combining {len(converted_files)} background video clips into {os.path.basename(output_path)}...")
-    command = [
-        "ffmpeg", "-y",
-        "-f", "concat", "-safe", "0",
-        "-i", input_list_filename,
-        "-c:v", "libx264",
-        "-preset", preset_val,
-        "-crf", str(crf_val),
-        "-pix_fmt", "yuv420p",
-        "-c:a", "aac",
-        "-b:a", "128k",
-        "-r", str(frame_rate),
-        "-b:v", bitrate,
-        "-avoid_negative_ts", "make_zero",
-        output_path
-    ]
+    print(f"🎬 Combining {len(input_files)} background video clips into {os.path.basename(output_path)}...")
 
     try:
-        # Use subprocess.Popen to get real-time output for progress bar
-        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        _parse_ffmpeg_progress(process, target_duration, frame_rate, description="Combining background videos") # Pass frame_rate
-
-        # Wait for the process to complete and check its return code
-        stdout, stderr = process.communicate()
-        if process.returncode != 0:
+        returncode, stderr = _run_ffmpeg(command, target_duration, frame_rate,
+                                         description="Combining background videos",
+                                         stdin_data=stdin_data)
+        if returncode != 0:
             print(f"❌ FFmpeg command failed during background combination:\n{stderr.decode()}")
         else:
             print(f"✅ Successfully combined background videos into {os.path.basename(output_path)}")
@@ -284,12 +902,6 @@ def combine_videos_for_duration(target_duration: float, output_filename: str = "
         print("Error: ffmpeg not found. Please ensure it is installed and in your system's PATH.")
     except Exception as e:
         print(f"An unexpected error occurred during background video combination: {e}")
-    finally:
-        if os.path.exists(input_list_filename):
-            os.remove(input_list_filename)
-        for f in converted_files:
-            if os.path.exists(f):
-                os.remove(f)
 
 
 # =============================================================================
@@ -302,10 +914,12 @@ def combine_green_screen_foreground_length(foreground_video: str, background_vid
                                            output_video: str = "combined_video.mp4",
                                            key_color: str = "0x00FF00", similarity: str = "0.3",
                                            preset_val: str = "veryfast", crf_val: int = 23,
-                                           frame_rate: float = 29.97) -> None: # Added frame_rate
+                                           frame_rate: float = TARGET_FRAME_RATE, # Added frame_rate
+                                           video_codec: str | None = None) -> None:
     """
     Combines two videos using FFmpeg's chromakey filter with a progress bar.
     The output video's length will be trimmed to match the foreground video's duration.
+    If `video_codec` is None, the fastest available encoder is used.
     """
     if not os.path.exists(foreground_video):
         print(f"Error: Foreground video '{foreground_video}' not found.")
@@ -328,7 +942,8 @@ def combine_green_screen_foreground_length(foreground_video: str, background_vid
         foreground_duration = float(foreground_duration_str)
 
         ffmpeg_cmd = [
-            "ffmpeg", "-y",
+            "ffmpeg", *_FFMPEG_QUIET_ARGS, "-y",
+            "-progress", "pipe:1",
             "-i", foreground_video,
             "-i", background_video,
             "-filter_complex",
@@ -337,9 +952,7 @@ def combine_green_screen_foreground_length(foreground_video: str, background_vid
             f"[bg_trimmed][fg]overlay[out]",
             "-map", "[out]",
             "-map", "0:a?",
-            "-c:v", "libx264", # Explicitly setting codec, important for preset/crf
-            "-preset", preset_val,
-            "-crf", str(crf_val),
+            *_video_encoder_args(video_codec or _detect_encoder(), preset_val, crf_val),
             "-pix_fmt", "yuv420p", # Ensure pix_fmt is set
             "-c:a", "copy",
             "-t", str(foreground_duration),
@@ -347,13 +960,9 @@ def combine_green_screen_foreground_length(foreground_video: str, background_vid
         ]
 
         print(f"🧪 Applying green screen effect and combining videos into {os.path.basename(output_video)}...")
-        # Use subprocess.Popen to get real-time output for progress bar
-        process = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        _parse_ffmpeg_progress(process, foreground_duration, frame_rate, description="Applying green screen") # Pass frame_rate
-
-        # Wait for the process to complete and check its return code
-        stdout, stderr = process.communicate()
-        if process.returncode != 0:
+        returncode, stderr = _run_ffmpeg(ffmpeg_cmd, foreground_duration, frame_rate,
+                                         description="Applying green screen")
+        if returncode != 0:
             print(f"❌ Error during ffmpeg processing:\n{stderr.decode()}")
         else:
             print(f"✅ Successfully combined '{os.path.basename(foreground_video)}' and '{os.path.basename(background_video)}' "
@@ -368,11 +977,86 @@ def combine_green_screen_foreground_length(foreground_video: str, background_vid
         print(f"An unexpected error occurred during green screen combination: {e}")
 
 
+def combine_green_screen_single_pass(foreground_video: str, background_clips: list[str],
+                                     output_video: str = "final_output.mp4",
+                                     foreground_duration: float | None = None,
+                                     key_color: str = "0x00FF00", similarity: str = "0.3",
+                                     frame_width: int = 1080, frame_height: int = 1920,
+                                     frame_rate: float = TARGET_FRAME_RATE,
+                                     preset_val: str = "veryfast", crf_val: int = 23,
+                                     video_codec: str | None = None) -> None:
+    """
+    Concatenates the background clips and applies the green screen overlay in a
+    single FFmpeg run, so the background is never encoded to an intermediate file.
+    Cached normalized copies are read through one concat-demuxer input; other
+    clips are normalized in the filtergraph (see `_build_background_inputs`).
+    The output video's length is trimmed to match the foreground video's duration.
+    If `video_codec` is None, the fastest available encoder is used.
+    """
+    if not os.path.exists(foreground_video):
+        print(f"Error: Foreground video '{foreground_video}' not found.")
+        return
+    if not background_clips:
+        print("Error: No background clips were provided.")
+        return
+
+    if foreground_duration is None:
+        foreground_duration = get_mp4_duration_mediainfo(foreground_video)
+        if foreground_duration is None:
+            print("Error: Could not determine the duration of the foreground video.")
+            return
+
+    input_args, stdin_data, background_graph = _build_background_inputs(
+        background_clips, first_input_index=1, frame_width=frame_width, frame_height=frame_height,
+        frame_rate=frame_rate, output_label="bg_joined"
+    )
+    filter_graph = (
+        background_graph + ";"
+        f"[bg_joined]trim=end={foreground_duration},setpts=PTS-STARTPTS[bg];"
+        f"[0:v]chromakey={key_color}:{similarity}[fg];"
+        f"[bg][fg]overlay,format=yuv420p[out]"
+    )
+
+    ffmpeg_cmd = [
+        "ffmpeg", *_FFMPEG_QUIET_ARGS, "-y",
+        "-progress", "pipe:1",
+        "-i", foreground_video,
+        *input_args,
+        "-filter_complex", filter_graph,
+        "-map", "[out]",
+        "-map", "0:a?",
+        *_video_encoder_args(video_codec or _detect_encoder(), preset_val, crf_val),
+        "-c:a", "copy",
+        "-t", str(foreground_duration),
+        output_video
+    ]
+
+    try:
+        print(f"🧪 Combining {len(background_clips)} background clips with the green screen foreground "
+              f"into {os.path.basename(output_video)}...")
+        returncode, stderr = _run_ffmpeg(ffmpeg_cmd, foreground_duration, frame_rate,
+                                         description="Rendering final video", stdin_data=stdin_data)
+        if returncode != 0:
+            print(f"❌ Error during ffmpeg processing:\n{stderr.decode()}")
+        else:
+            print(f"✅ Successfully rendered '{os.path.basename(output_video)}' "
+                  f"(trimmed to foreground length).")
+    except FileNotFoundError:
+        print("Error: ffmpeg not found. Please ensure it is installed and in your system's PATH.")
+    except Exception as e:
+        print(f"An unexpected error occurred during single-pass green screen rendering: {e}")
+
+
 # =============================================================================
 # Section 4: Main Pipeline (Originally from full_pipeline.py)
 # Orchestrates the entire process: duration check -> background generation -> green screen merge.
 # =============================================================================
 
+# Background clip folders, relative to the script directory. The API only
+# accepts these, since the clip caches are written into the selected folder.
+BACKGROUND_CATEGORIES = ("Clips", "Gameplay", "Gameplay 2", "Gameplay 3")
+
+
 def main():
     """
     Main function to run the complete video processing pipeline.
@@ -382,7 +1066,7 @@ def main():
     script_dir = os.path.dirname(__file__)
 
     # ✅ Ask user which background folder to use
-    print("\n📁 Available background categories: Clips, Gameplay, Gameplay 2, Gameplay 3")
+    print(f"\n📁 Available background categories: {', '.join(BACKGROUND_CATEGORIES)}")
     selected_category = input("Enter background category to use (default is 'Clips'): ").strip()
     if not selected_category:
         selected_category = "Clips"
@@ -393,7 +1077,6 @@ def main():
         return
 
     foreground_video = os.path.join(script_dir, "foreground.mp4")
-    background_output = os.path.join(script_dir, "background_combined.mp4")
     final_output = os.path.join(script_dir, "final_output.mp4")
 
     print(f"\n🎥 Step 1: Checking duration of the foreground video: {os.path.basename(foreground_video)}")
@@ -407,40 +1090,44 @@ def main():
 
     current_preset = "veryfast"
     current_crf = 23
-    target_frame_rate = 30.0
 
-    print(f"\n🎲 Step 2: Generating background video using clips from '{selected_category}'...")
+    print(f"\n🎲 Step 2: Selecting background clips from '{selected_category}'...")
+    selected_clips = select_clips_for_duration(duration, clips_dir=clips_dir_path)
+    # Reuse cached normalized copies where they exist; the render graph
+    # normalizes the remaining clips itself, so nothing is transcoded up front
+    background_clips = prepare_normalized_clips(selected_clips, frame_width=1080, frame_height=1920,
+                                                frame_rate=TARGET_FRAME_RATE, convert_missing=False)
+    uncached_clips = [clip for clip, prepared in zip(selected_clips, background_clips) if prepared == clip]
+
+    if not background_clips:
+        print("❌ Pipeline aborted: No valid background clips were selected.")
+        return
 
-    combine_videos_for_duration(
-        target_duration=duration,
-        output_filename=background_output,
-        clips_dir=clips_dir_path,
+    print(f"\n🧪 Step 3: Rendering background and green screen effect in a single pass...")
+    combine_green_screen_single_pass(
+        foreground_video=foreground_video,
+        background_clips=background_clips,
+        output_video=final_output,
+        foreground_duration=duration,
         frame_width=1080,
         frame_height=1920,
-        frame_rate=target_frame_rate,
-        bitrate="6M",
+        frame_rate=TARGET_FRAME_RATE,
         preset_val=current_preset,
         crf_val=current_crf
     )
 
-    if not os.path.exists(background_output):
-        print("❌ Pipeline aborted: Background video was not successfully generated.")
+    if not os.path.exists(final_output):
+        print("\n❌ Pipeline failed: Final output video was not created.")
         return
 
-    print(f"\n🧪 Step 3: Applying green screen effect...")
-    combine_green_screen_foreground_length(
-        foreground_video=foreground_video,
-        background_video=background_output,
-        output_video=final_output,
-        preset_val=current_preset,
-        crf_val=current_crf,
-        frame_rate=target_frame_rate
-    )
+    print(f"\n✅ Pipeline completed successfully! Final output saved as: '{os.path.basename(final_output)}'")
 
-    if os.path.exists(final_output):
-        print(f"\n✅ Pipeline completed successfully! Final output saved as: '{os.path.basename(final_output)}'")
-    else:
-        print("\n❌ Pipeline failed: Final output video was not created.")
+    # The render is done, so normalize the clips that had no cached copy now;
+    # later runs that pick them skip their per-clip normalization
+    if uncached_clips:
+        print(f"\n💾 Step 4: Caching normalized copies of {len(uncached_clips)} background clips for later runs...")
+        prepare_normalized_clips(uncached_clips, frame_width=1080, frame_height=1920,
+                                 frame_rate=TARGET_FRAME_RATE)
 
 
 # Entry point for the script